@@ -4,9 +4,12 @@ Accounting Reports
 Usage:
   accounting-reports chart-of-accounts --db=<PATH> [--output=<FORMAT>] [--verbose]
   accounting-reports balances --db=<PATH> [--accounts=<ACCOUNTS>] [--begin=<BEGIN_DATE>]
-                     [--end=<END_DATE>] [--output=<FORMAT>] [--verbose]
+                     [--end=<END_DATE>] [--snapshot=<PATH>] [--output=<FORMAT>] [--watch]
+                     [--open-if-locked=<BOOL>] [--verbose]
   accounting-reports budget --db=<PATH> --accounts=<ACCOUNTS> [--begin=<BEGIN_DATE>]
-                     [--end=<END_DATE>] [--output=<FORMAT>] [--verbose]
+                     [--end=<END_DATE>] [--output=<FORMAT>] [--watch] [--verbose]
+  accounting-reports snapshot build --db=<PATH> [--snapshot=<PATH>] [--full] [--verbose]
+  accounting-reports snapshot verify --db=<PATH> [--snapshot=<PATH>] [--output=<FORMAT>] [--verbose]
   accounting-reports display-accounts --db=<PATH> --accounts=<ACCOUNTS> [--open-if-locked=<BOOL>]
   accounting-reports -h | --help
   accounting-reports --version
@@ -18,7 +21,12 @@ Options:
   --begin=<BEGIN_DATE>         Begin date of balances (yyyy-mm-dd).  Default: first day of the year.
   --end=<END_DATE>             Date to get balances as-of (yyyy-mm-dd).  Default: last day of
                                previous month.
+  --snapshot=<PATH>            Path to month-end balance snapshot.  Default for `snapshot`: alongside
+                               the SQLite file.  `balances` only uses a snapshot when given.
+  --full                       Rebuild the snapshot from scratch rather than updating it.
   --output=<FORMAT>            Format to output results in (csv, json). [Default: csv]
+  --watch                      Keep running, re-outputting results that change whenever the SQLite
+                               file is saved.
   --open-if-locked=<BOOL>      Open the GNUCash DB if it's already open elsewhere. [Default: False]
   --verbose                    Verbose logging.
   -h --help                    Show this screen.
@@ -27,6 +35,7 @@ Options:
 
 import os
 from pprint import pprint
+from datetime import date
 from decimal import Decimal
 from logging import info, debug
 from docopt import docopt
@@ -37,7 +46,11 @@ sys.path.insert(0, os.getcwd()) # workaround for running in PyCharm
 
 from accounting_reports.version import __version__  # noqa
 from accounting_reports.util import (configure_logging, csv_to_list, filter_list, begin_or_default,
-                  end_or_default, output_arg, list_of_months_from, split_value, read_list_from_file)  # noqa
+                  end_or_default, output_arg, list_of_months_from, split_value, read_list_from_file,
+                  previous_month_end, snapshot_or_default, bool_arg)  # noqa
+from accounting_reports.snapshot import (build_snapshot, verify_snapshot, load_snapshot,
+                  snapshot_balance_of, split_totals)  # noqa
+from accounting_reports.watch import watch_book  # noqa
 
 
 def display_accounts(database, accounts, open_if_lock=False):
@@ -62,64 +75,82 @@ def display_accounts(database, accounts, open_if_lock=False):
                 print('-' * 50)
 
 
-def budget_report(database, accounts, begin, end, output_func):
+def budget_report(database, accounts, begin, end, output_func, watch=False):
     """
     Prints a report for the given accounts with the budgeted amount and the actual balance.
     """
     debug('budget_report called with [%s] [%s]' % (database, begin))
-    with open_book(database, open_if_lock=True) as book:
-        all_accounts = book.accounts
-        acctlist = filter_list(all_accounts, accounts)
-        datelist = list_of_months_from(begin, end)
+    datelist = list_of_months_from(begin, end)
+
+    def cells_of(book):
+        acctlist = filter_list(book.accounts, accounts)
+        return [(account, begin, month_end) for month_end in datelist for account in acctlist]
 
-        for end in datelist:
-            for account in acctlist:
-                (budget_balance, actual_balance) = budget_balance_of(account, begin, end)
+    def result_of(book, account, begin, end):
+        return budget_result(account, begin, end)
 
-                result = {
-                    'date': end.strftime('%Y-%m'),
-                    'account_code': account.code if account.code else None,
-                    'account': account.fullname,
-                    'budget_balance': budget_balance,
-                    'actual_balance': actual_balance
-                }
-                output_func(result)
+    if watch:
+        watch_book(database, cells_of, result_of, output_func, open_if_lock=True)
+        return
+
+    with open_book(database, open_if_lock=True) as book:
+        for cell in cells_of(book):
+            output_func(result_of(book, *cell))
 
 
-def account_balances(database, accounts, begin, end, output_func):
+def budget_result(account, begin, end):
     """
-    Prints the balances for the given accounts in the specified format.
+    Returns the budget report result for the given account over the given date range.
+    """
+    (budget_balance, actual_balance) = budget_balance_of(account, begin, end)
+    return {
+        'date': end.strftime('%Y-%m'),
+        'account_code': account.code if account.code else None,
+        'account': account.fullname,
+        'budget_balance': budget_balance,
+        'actual_balance': actual_balance
+    }
+
+
+def account_balances(database, accounts, begin, end, output_func, snapshot_path=None, watch=False,
+                     open_if_lock=False):
+    """
+    Prints the balances for the given accounts in the specified format.  When a snapshot is given,
+    balances are answered from its month-end balances plus the splits posted after them.
     """
     debug('account_balance called with [%s] [%s] [%s--%s]' % (database, accounts, begin, end))
-    with open_book(database) as book:
-        acctlist = filter_list(book.accounts, accounts)
-        for account in acctlist:
-            result = {
-                'account_code': account.code if account.code else None,
-                'account_name': account.fullname,
-                'balance': balance_of(account, begin, end)
-            }
-            output_func(result)
+    snapshot = load_snapshot(snapshot_path) if snapshot_path else None
+    if snapshot_path and not snapshot:
+        raise ValueError('no snapshot found at [%s]' % snapshot_path)
+
+    def cells_of(book):
+        return [(account, begin, end) for account in filter_list(book.accounts, accounts)]
+
+    def result_of(book, account, begin, end):
+        if snapshot and end:
+            balance = snapshot_balance_of(book, snapshot, account, begin, end)
+        else:
+            balance = balance_of(account, begin, end)
+        return {
+            'account_code': account.code if account.code else None,
+            'account_name': account.fullname,
+            'balance': balance
+        }
+
+    if watch:
+        watch_book(database, cells_of, result_of, output_func, open_if_lock=open_if_lock)
+        return
+
+    with open_book(database, open_if_lock=open_if_lock) as book:
+        for cell in cells_of(book):
+            output_func(result_of(book, *cell))
 
 
 def budget_balance_of(account, begin, end):
     """
     Returns a tuple of (budgeted,actual) amounts for the given budget account.
     """
-    budget_balance = 0
-    actual_balance = 0
-    for split in account.splits:
-        transaction = split.transaction
-        post_date = transaction.post_date
-        if begin <= post_date <= end:
-            debug('post_date (%s) is between (%s--%s)' % (post_date, begin, end))
-            if split.value >= 0:
-                budget_balance += split.value
-            if split.value < 0:
-                actual_balance += split.value
-
-    budget_balance = Decimal(budget_balance)
-    actual_balance = Decimal(actual_balance)
+    (budget_balance, actual_balance) = split_totals(account.book, account.guid, begin, end)
     debug('account:[%s] over [%s--%s]: (%d/%d)' %
           (account.fullname, begin, end, budget_balance, actual_balance))
     return budget_balance.quantize(Decimal('0.01')), actual_balance.quantize(Decimal('0.01'))
@@ -131,12 +162,8 @@ def balance_of(account, begin, end):
     """
     balance = 0
     if end:
-        for split in account.splits:
-            transaction = split.transaction
-            post_date = transaction.post_date
-            if begin <= post_date <= end:
-                debug('post_date (%s) is between (%s--%s)' % (post_date, begin, end))
-                balance += split.value * account.sign
+        (positive, negative) = split_totals(account.book, account.guid, begin, end)
+        balance = (positive + negative) * account.sign
     else:
         balance = account.get_balance()
     balance = Decimal(balance)
@@ -184,10 +211,18 @@ def main():
         chart_of_accounts(db_file, output_func)
 
     if args['balances']:
-        account_balances(db_file, accounts, begin, end, output_func)
+        account_balances(db_file, accounts, begin, end, output_func, args['--snapshot'],
+                         args['--watch'], bool_arg(args['--open-if-locked']))
+
+    if args['snapshot']:
+        snapshot_path = snapshot_or_default(db_file, args['--snapshot'])
+        if args['build']:
+            build_snapshot(db_file, snapshot_path, previous_month_end(date.today()), args['--full'])
+        if args['verify'] and verify_snapshot(db_file, snapshot_path, output_func):
+            sys.exit(1)
 
     if args['budget']:
-        budget_report(db_file, accounts, begin, end, output_func)
+        budget_report(db_file, accounts, begin, end, output_func, args['--watch'])
 
     if args['display-accounts']:
         open_if_locked = args['--open-if-locked']
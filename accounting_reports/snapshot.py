@@ -0,0 +1,373 @@
+"""
+Month-end balance snapshots.
+
+A snapshot is a JSON file holding, per account, the total and cumulative value of its splits for
+every month that has activity, along with a hash of the splits that make up each month.  Balances
+as-of a date can then be answered from the nearest prior month-end plus only the splits posted
+after it.
+"""
+import os
+import re
+from hashlib import sha256
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from json import dump, load
+from logging import info, debug
+from piecash import open_book, sa_extra
+from sqlalchemy import bindparam, text
+
+from accounting_reports.util import last_day_of_month, parse_date, previous_month_end
+
+SNAPSHOT_VERSION = 3
+
+
+# Post dates are stored as `yyyymmddhhmmss` or `yyyy-mm-dd hh:mm:ss` in UTC, depending on the
+# GnuCash version that wrote them.  piecash reads them as the date of that time in the local
+# timezone, which older versions stored as local midnight; `local_post_date` and
+# `post_date_filter` follow the same rules.
+POST_DATE_RE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2}) ?(\d{2}):?(\d{2}):?(\d{2})')
+
+MONTH_DIGESTS_SQL = """
+SELECT splits.account_guid, splits.guid, transactions.post_date,
+       splits.value_num, splits.value_denom
+FROM splits JOIN transactions ON splits.tx_guid = transactions.guid
+WHERE %(where)s
+"""
+
+SPLIT_TOTALS_SQL = """
+SELECT splits.value_denom,
+       sum(CASE WHEN splits.value_num >= 0 THEN splits.value_num ELSE 0 END),
+       sum(CASE WHEN splits.value_num < 0 THEN splits.value_num ELSE 0 END)
+FROM splits JOIN transactions ON splits.tx_guid = transactions.guid
+WHERE splits.account_guid = :account_guid AND %(where)s
+GROUP BY splits.value_denom
+"""
+
+
+def local_post_date(post_date):
+    """
+    Returns the date piecash reads from the given stored post date.
+    """
+    fields = [int(field) for field in POST_DATE_RE.match(post_date).groups()]
+    return sa_extra.utc.localize(datetime(*fields)).astimezone(sa_extra.tz).date()
+
+
+def stored_post_dates(val):
+    """
+    Returns the stored post date, in both of its formats, of local midnight at the start of the
+    given date.
+    """
+    start = sa_extra.tz.localize(datetime.combine(val, time(0, 0))).astimezone(sa_extra.utc)
+    return start.strftime('%Y%m%d%H%M%S'), start.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def post_date_filter(begin=None, end=None):
+    """
+    Returns the SQL condition and parameters matching transactions whose post date, as piecash
+    reads it, is between `begin` and `end` inclusive.  Either may be None.
+
+    The bounds are compared against the stored post dates directly, in whichever format each is
+    stored in, so that the index on post_date can be used.
+    """
+    compact = ["substr(transactions.post_date, 5, 1) != '-'"]
+    dashed = ["substr(transactions.post_date, 5, 1) = '-'"]
+    params = {}
+    if begin:
+        (params['begin_compact'], params['begin_dashed']) = stored_post_dates(begin)
+        compact.append('transactions.post_date >= :begin_compact')
+        dashed.append('transactions.post_date >= :begin_dashed')
+    if end:
+        (params['end_compact'], params['end_dashed']) = stored_post_dates(end + timedelta(days=1))
+        compact.append('transactions.post_date < :end_compact')
+        dashed.append('transactions.post_date < :end_dashed')
+    return '((%s) OR (%s))' % (' AND '.join(compact), ' AND '.join(dashed)), params
+
+
+def split_totals(book, account_guid, begin, end):
+    """
+    Returns a tuple of the (positive, negative) totals of the values of the account's splits
+    posted between `begin` and `end` inclusive.
+    """
+    (where, params) = post_date_filter(begin, end)
+    params['account_guid'] = account_guid
+    positive = Decimal(0)
+    negative = Decimal(0)
+    for (value_denom, positive_num, negative_num) in \
+            book.session.execute(text(SPLIT_TOTALS_SQL % {'where': where}), params):
+        positive += Decimal(positive_num) / Decimal(value_denom)
+        negative += Decimal(negative_num) / Decimal(value_denom)
+    return positive, negative
+
+
+def month_digests(book, after=None, until=None, account_guids=None, by_account=False):
+    """
+    Summarizes the splits in the book by account and month with a single query.
+
+    Args:
+        book: An open piecash `Book`.
+        after: Only include splits posted strictly after this date. May be None.
+        until: Only include splits posted on or before this date. May be None.
+        account_guids: Only include splits for these accounts. May be None.
+        by_account: Look the splits up by account rather than by post date, which is quicker for
+            a few accounts over a long period.
+
+    Returns:
+        As `monthly_totals`.
+    """
+    (where, params) = post_date_filter(after + timedelta(days=1) if after else None, until)
+    bind = []
+    if account_guids is not None:
+        # unless looking up by account, the unary + keeps SQLite from preferring the account index
+        # over the post_date one
+        where += ' AND %ssplits.account_guid IN :account_guids' % ('' if by_account else '+')
+        params['account_guids'] = list(account_guids)
+        bind.append(bindparam('account_guids', expanding=True))
+    query = text(MONTH_DIGESTS_SQL % {'where': where})
+    if bind:
+        query = query.bindparams(*bind)
+
+    post_dates = {}
+    rows = []
+    # fetched at once, which is much quicker than row by row for large books
+    for (account_guid, split_guid, post_date, value_num, value_denom) in \
+            book.session.execute(query, params).fetchall():
+        if post_date not in post_dates:
+            post_dates[post_date] = local_post_date(post_date)
+        rows.append((account_guid, split_guid, post_dates[post_date], value_num, value_denom))
+    return monthly_totals(rows)
+
+
+def month_key(val):
+    """
+    Returns the `yyyy-mm` key of the month containing the given date.
+    """
+    return val.strftime('%Y-%m')
+
+
+def monthly_totals(rows):
+    """
+    Totals and hashes the splits of each account and month.
+
+    Args:
+        rows: Iterable of `(account_guid, split_guid, post_date, value_num, value_denom)`, as
+            selected by `month_digests`.
+
+    Returns:
+        A dict of `{account_guid: {month: {'value': Decimal, 'hash': str}}}` where `month` is
+        `yyyy-mm`, `value` is the sum of the split values in that month and `hash` is a digest of
+        those splits.
+    """
+    months = {}
+    # splits share post dates, so each is formatted only once
+    formatted = {}
+    for (account_guid, split_guid, post_date, value_num, value_denom) in rows:
+        if post_date not in formatted:
+            formatted[post_date] = (month_key(post_date), post_date.strftime('%Y%m%d'))
+        (month, day) = formatted[post_date]
+        (entries, numerators) = months.setdefault(account_guid, {}).setdefault(month, ([], {}))
+        entries.append('%s:%s:%s:%s' % (split_guid, day, value_num, value_denom))
+        # summed per denominator so only one Decimal division is needed for each
+        numerators[value_denom] = numerators.get(value_denom, 0) + value_num
+
+    totals = {}
+    for account_guid, account_months in months.items():
+        totals[account_guid] = {}
+        for month, (entries, numerators) in account_months.items():
+            value = sum((Decimal(value_num) / Decimal(value_denom)
+                         for value_denom, value_num in numerators.items()), Decimal(0))
+            totals[account_guid][month] = {
+                'value': value,
+                'hash': sha256('\n'.join(sorted(entries)).encode('utf-8')).hexdigest(),
+            }
+    return totals
+
+
+def update_months(accounts, totals, names):
+    """
+    Brings the accounts of a snapshot in line with the given monthly totals, rewriting only the
+    months whose hash has changed and recomputing cumulative values forward from the earliest of
+    them.
+
+    Returns:
+        The number of months rewritten.
+    """
+    rewritten = 0
+    for account_guid in set(accounts) | set(totals):
+        entry = accounts.setdefault(account_guid, {'months': {}})
+        entry['account_name'] = names.get(account_guid, entry.get('account_name'))
+        stored = entry['months']
+        actual = totals.get(account_guid, {})
+
+        changed = set()
+        for month in set(stored) | set(actual):
+            if month not in actual:
+                del stored[month]
+                changed.add(month)
+            elif stored.get(month, {}).get('hash') != actual[month]['hash']:
+                stored[month] = {'value': str(actual[month]['value']),
+                                 'hash': actual[month]['hash']}
+                changed.add(month)
+        if not stored:
+            del accounts[account_guid]
+        if not changed:
+            continue
+
+        rewritten += len(changed)
+        earliest = min(changed)
+        cumulative = Decimal(0)
+        for month in sorted(stored):
+            if month < earliest:
+                cumulative = Decimal(stored[month]['cumulative'])
+                continue
+            cumulative += Decimal(stored[month]['value'])
+            stored[month]['cumulative'] = str(cumulative)
+    return rewritten
+
+
+def load_snapshot(path):
+    """
+    Reads the snapshot at `path`, or returns None if there isn't one.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path) as snapshot_file:
+        snapshot = load(snapshot_file)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version [%s] in [%s]' % (snapshot.get('version'), path))
+    return snapshot
+
+
+def save_snapshot(path, snapshot):
+    """
+    Writes the snapshot to `path`, replacing any existing file only once it's fully written.
+    """
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as snapshot_file:
+        dump(snapshot, snapshot_file, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(database, path, through, full=False):
+    """
+    Builds or updates the snapshot at `path` with month-end balances up to `through`.
+
+    The splits of every month up to `through` are re-hashed with one query, and only
+    the months whose hash differs from the stored one are rewritten, so back-dated edits are
+    repaired as well as new months added.  A `full` build discards the existing snapshot first.
+    """
+    snapshot = None
+    if not full:
+        try:
+            snapshot = load_snapshot(path)
+        except ValueError as error:
+            info('rebuilding snapshot [%s]: %s' % (path, error))
+    if not snapshot:
+        snapshot = {'version': SNAPSHOT_VERSION, 'accounts': {}}
+
+    debug('build_snapshot called with [%s] [%s] [%s]' % (database, path, through))
+    with open_book(database, open_if_lock=True) as book:
+        names = {account.guid: account.fullname for account in book.accounts}
+        totals = month_digests(book, until=through)
+    rewritten = update_months(snapshot['accounts'], totals, names)
+
+    snapshot['through'] = through.isoformat()
+    save_snapshot(path, snapshot)
+    info('snapshot [%s] built through [%s], [%d] months rewritten' % (path, through, rewritten))
+    return snapshot
+
+
+def verify_snapshot(database, path, output_func):
+    """
+    Compares the snapshot at `path` against the book, emitting a result for each month whose
+    splits no longer match it.
+
+    Returns:
+        The number of mismatched months.
+    """
+    snapshot = load_snapshot(path)
+    if not snapshot:
+        raise ValueError('no snapshot found at [%s]' % path)
+    through = parse_date(snapshot['through'])
+
+    with open_book(database, open_if_lock=True) as book:
+        names = {account.guid: account.fullname for account in book.accounts}
+        totals = month_digests(book, until=through)
+
+    mismatches = 0
+    for account_guid in sorted(set(totals) | set(snapshot['accounts'])):
+        actual = totals.get(account_guid, {})
+        stored = snapshot['accounts'].get(account_guid, {}).get('months', {})
+        cumulative = Decimal(0)
+        for month in sorted(set(actual) | set(stored)):
+            status = None
+            if month in stored:
+                cumulative += Decimal(stored[month]['value'])
+            if month not in stored:
+                status = 'missing'
+            elif month not in actual:
+                status = 'unexpected'
+            elif stored[month]['hash'] != actual[month]['hash']:
+                status = 'changed'
+            elif Decimal(stored[month]['cumulative']) != cumulative:
+                status = 'inconsistent'
+            if status:
+                mismatches += 1
+                output_func({
+                    'account_name': names.get(account_guid, account_guid),
+                    'month': month,
+                    'status': status,
+                })
+
+    info('snapshot [%s] verified through [%s] with [%d] mismatches' % (path, through, mismatches))
+    return mismatches
+
+
+def anchor_of(as_of, through):
+    """
+    Returns the latest month-end on or before `as_of` that's covered by a snapshot built through
+    `through`.
+    """
+    if as_of >= through:
+        return through
+    if as_of == last_day_of_month(as_of):
+        return as_of
+    return previous_month_end(as_of)
+
+
+def cumulative_value(snapshot, account_guid, anchor):
+    """
+    Returns the cumulative value of the account's splits through the month-end `anchor`.
+    """
+    months = snapshot['accounts'].get(account_guid, {}).get('months', {})
+    keys = sorted(months)
+    index = bisect_right(keys, month_key(anchor))
+    if not index:
+        return Decimal(0)
+    return Decimal(months[keys[index - 1]]['cumulative'])
+
+
+def value_as_of(book, snapshot, account, as_of):
+    """
+    Returns the unsigned total of the account's splits posted on or before `as_of`, using the
+    nearest prior month-end in the snapshot plus the splits posted after it.
+    """
+    anchor = anchor_of(as_of, parse_date(snapshot['through']))
+    value = cumulative_value(snapshot, account.guid, anchor)
+    if as_of > anchor:
+        months = month_digests(book, after=anchor, until=as_of, account_guids=[account.guid])
+        for month in months.get(account.guid, {}).values():
+            value += month['value']
+    return value
+
+
+def snapshot_balance_of(book, snapshot, account, begin, end):
+    """
+    Returns the balance of the given account over the given date range, as `balance_of` does.
+    """
+    balance = value_as_of(book, snapshot, account, end) \
+        - value_as_of(book, snapshot, account, begin - timedelta(days=1))
+    balance = Decimal(balance * account.sign)
+    debug('snapshot_balance_of account:[%s] over [%s--%s]: [%d]' %
+          (account.fullname, begin, end, balance))
+    return balance.quantize(Decimal('0.01'))
@@ -37,6 +37,13 @@ def output_arg(val):
     }[val]
 
 
+def bool_arg(val):
+    """
+    Returns True if the given option value is `true`, `yes` or `1`, ignoring case.
+    """
+    return str(val).lower() in ('true', 'yes', '1')
+
+
 class DecimalEncoder(JSONEncoder):
     """
     Ensures floats are properly encoded.
@@ -108,8 +115,7 @@ def begin_or_default(val):
     as a `date` instance.
     """
     if val:
-        parsed_date = strptime(val, '%Y-%m-%d')
-        return date(parsed_date[0], parsed_date[1], parsed_date[2])
+        return parse_date(val)
     else:
         today = date.today()
         return date(today.year, 1, 1)
@@ -134,6 +140,30 @@ def end_or_default(val):
         return last_day_of_month(today)
 
 
+def parse_date(val):
+    """
+    Returns the given string, formatted as `%Y-%m-%d`, as a `date` instance.
+    """
+    parsed_date = strptime(val, '%Y-%m-%d')
+    return date(parsed_date[0], parsed_date[1], parsed_date[2])
+
+
+def previous_month_end(val):
+    """
+    Returns the last day of the month before the one containing `val`.
+    """
+    return first_day_of_month(val) - timedelta(days=1)
+
+
+def snapshot_or_default(database, val):
+    """
+    Returns `val` if given, else the default snapshot path alongside the given database.
+    """
+    if val:
+        return val
+    return '%s.snapshot.json' % database
+
+
 def filter_list(all_accounts, filtered_accounts):
     """
     Returns all accounts if filtered is empty, else return accounts named in filtered_accounts
@@ -0,0 +1,237 @@
+"""
+Watch mode: keeps the book open and re-emits report results as the GnuCash file changes.
+
+A report is described as a list of cells, each of which is the result for one account over a
+date range.  When the file changes, the splits of the watched accounts are re-hashed per account
+and month (as for snapshots), and only the cells whose account and date range cover a changed month
+are recomputed.  Results that differ from the last ones emitted are output again.
+
+To keep saves cheap to check, the re-hash is narrowed using a per-account signature of the splits
+(count, total value and last rowid) and the post dates of the existing transactions: splits added
+since the last check only re-hash their own months, and splits edited or deleted in place re-hash
+every watched month of their accounts.  Re-dated or deleted transactions re-hash everything watched.
+"""
+import os
+from sys import stdout
+from time import sleep
+from datetime import timedelta
+from logging import info, debug
+from piecash import open_book
+from sqlalchemy import bindparam, text
+
+from accounting_reports.snapshot import local_post_date, month_digests, month_key
+from accounting_reports.util import last_day_of_month
+
+WATCH_INTERVAL = 0.25
+
+SPLIT_SIGNATURES_SQL = text("""
+SELECT account_guid, count(*), sum(value_num), max(rowid) FROM splits
+WHERE account_guid IN :account_guids GROUP BY account_guid
+""").bindparams(bindparam('account_guids', expanding=True))
+
+NEW_SPLITS_SQL = text("""
+SELECT splits.rowid, splits.account_guid, transactions.post_date, splits.value_num
+FROM splits JOIN transactions ON splits.tx_guid = transactions.guid
+WHERE splits.rowid > :rowid
+""")
+
+LAST_ROWIDS_SQL = text("""
+SELECT (SELECT max(rowid) FROM splits), (SELECT max(rowid) FROM transactions)
+""")
+
+POST_DATES_SQL = text("""
+SELECT group_concat(guid || post_date) FROM transactions WHERE rowid <= :rowid
+""")
+
+
+def file_changes(path, interval=WATCH_INTERVAL):
+    """
+    Polls the given file, yielding each time its modification time or size changes.
+    """
+    last = None
+    while True:
+        try:
+            stat = os.stat(path)
+        except OSError as error:
+            # the file can briefly go missing while it's replaced on save
+            debug('unable to stat [%s]: %s' % (path, error))
+            sleep(interval)
+            continue
+        current = (stat.st_mtime_ns, stat.st_size)
+        if last and current != last:
+            debug('[%s] changed' % path)
+            yield
+        last = current
+        sleep(interval)
+
+
+def changed_months(previous, latest):
+    """
+    Returns the set of `(account_guid, month)` whose splits differ between two results of
+    `month_digests`.
+    """
+    changed = set()
+    for account_guid in set(previous) | set(latest):
+        before = previous.get(account_guid, {})
+        after = latest.get(account_guid, {})
+        for month in set(before) | set(after):
+            if before.get(month, {}).get('hash') != after.get(month, {}).get('hash'):
+                changed.add((account_guid, month))
+    return changed
+
+
+def book_state(book, account_guids):
+    """
+    Returns what `changed_scope` compares between checks: the last split rowid, the
+    `(count, sum(value_num), max(rowid))` of the splits of each watched account, and the guids and
+    post dates of the transactions in rowid order.
+    """
+    (splits_rowid, transactions_rowid) = book.session.execute(LAST_ROWIDS_SQL).fetchone()
+    signatures = {account_guid: (count, total, last) for (account_guid, count, total, last) in
+                  book.session.execute(SPLIT_SIGNATURES_SQL,
+                                       {'account_guids': sorted(account_guids)})}
+    post_dates = book.session.execute(
+        POST_DATES_SQL, {'rowid': transactions_rowid or 0}).scalar()
+    return {'splits_rowid': splits_rowid or 0, 'signatures': signatures, 'post_dates': post_dates}
+
+
+def expected_signatures(signatures, new_splits):
+    """
+    Returns the split signatures of the watched accounts expected if the only change since they
+    were taken is the addition of the given `(rowid, account_guid, post_date, value_num)` splits.
+    """
+    expected = dict(signatures)
+    for (rowid, account_guid, _, value_num) in new_splits:
+        (count, total, last) = expected.get(account_guid, (0, 0, 0))
+        expected[account_guid] = (count + 1, total + value_num, max(last, rowid))
+    return expected
+
+
+def changed_scope(book, previous, scope):
+    """
+    Returns the latest `book_state`, and the `(after, until, account_guids, by_account)` arguments
+    to `month_digests` that cover the splits that changed since `previous`, or None if none did.
+
+    Args:
+        book: An open piecash `Book`.
+        previous: The `book_state` at the last check.
+        scope: The `(after, until, account_guids)` being watched, as from `cells_scope`.
+    """
+    (after, until, account_guids) = scope
+    latest = book_state(book, account_guids)
+    if latest['post_dates'] is not None and previous['post_dates'] is not None and \
+            not latest['post_dates'].startswith(previous['post_dates']):
+        # an existing transaction was re-dated or deleted
+        return latest, (after, until, account_guids, False)
+    new_splits = [row for row in book.session.execute(
+        NEW_SPLITS_SQL, {'rowid': previous['splits_rowid']}) if row[1] in account_guids]
+    expected = expected_signatures(previous['signatures'], new_splits)
+    edited = {account_guid for account_guid in set(expected) | set(latest['signatures'])
+              if expected.get(account_guid) != latest['signatures'].get(account_guid)}
+    if edited:
+        # splits were edited or deleted in place, somewhere in these accounts
+        return latest, (after, until, edited, edited != account_guids)
+    if not new_splits:
+        return latest, None
+    post_dates = [local_post_date(post_date) for (_, _, post_date, _) in new_splits]
+    first = max(min(post_dates).replace(day=1) - timedelta(days=1), after)
+    last = min(last_day_of_month(max(post_dates)), until)
+    if first >= last:
+        return latest, None
+    return latest, (first, last, {account_guid for (_, account_guid, _, _) in new_splits}, False)
+
+
+def months_between(totals, after, until, account_guids):
+    """
+    Returns the months of the given accounts in a result of `month_digests` that fall in the
+    months from the day after `after` through `until`.
+    """
+    (first, last) = (month_key(after + timedelta(days=1)), month_key(until))
+    return {account_guid: {month: digest for (month, digest) in totals.get(account_guid, {}).items()
+                           if first <= month <= last}
+            for account_guid in account_guids}
+
+
+def merge_months(totals, latest, changed):
+    """
+    Replaces the changed `(account_guid, month)` of a result of `month_digests` with those of a
+    later one.
+    """
+    for (account_guid, month) in changed:
+        months = totals.setdefault(account_guid, {})
+        months.pop(month, None)
+        if month in latest.get(account_guid, {}):
+            months[month] = latest[account_guid][month]
+
+
+def is_affected(cell, changed):
+    """
+    Returns True if any of the changed months fall in the given cell's account and date range.
+    """
+    (account, begin, end) = cell
+    return any(account_guid == account.guid and month_key(begin) <= month <= month_key(end)
+               for (account_guid, month) in changed)
+
+
+def cells_scope(cells):
+    """
+    Returns the `(after, until, account_guids)` that bound the splits the given cells depend on,
+    as arguments to `month_digests`.
+    """
+    after = min(begin for (_, begin, _) in cells) - timedelta(days=1)
+    until = max(end for (_, _, end) in cells)
+    return after, until, {account.guid for (account, _, _) in cells}
+
+
+def watch_book(database, cells_of, result_of, output_func, open_if_lock=False,
+               interval=WATCH_INTERVAL):
+    """
+    Outputs the result of every cell, then re-outputs the results of cells that change each time
+    the database is saved, until interrupted.
+
+    Args:
+        database: Path to the SQLite file.
+        cells_of: Function of the open book returning a list of `(account, begin, end)` cells.
+        result_of: Function of `(book, account, begin, end)` returning the result of a cell.
+        output_func: Function to output each result with.
+        open_if_lock: Open the book even if it's locked by GnuCash.
+        interval: Seconds between checks of the database for changes.
+    """
+    debug('watch_book called with [%s]' % database)
+    with open_book(database, open_if_lock=open_if_lock) as book:
+        cells = cells_of(book)
+        if not cells:
+            info('nothing to watch in [%s]' % database)
+            return
+        scope = cells_scope(cells)
+        state = book_state(book, scope[2])
+        totals = month_digests(book, *scope)
+        results = []
+        for cell in cells:
+            results.append(result_of(book, *cell))
+            output_func(results[-1])
+        stdout.flush()
+
+        info('watching [%s] for changes' % database)
+        try:
+            for _ in file_changes(database, interval):
+                # drop everything the session has loaded so reads see the saved file
+                book.session.rollback()
+                (state, digest) = changed_scope(book, state, scope)
+                if digest is None:
+                    continue
+                latest = month_digests(book, *digest)
+                changed = changed_months(months_between(totals, *digest[:3]), latest)
+                merge_months(totals, latest, changed)
+                debug('months changed: [%s]' % sorted(changed))
+
+                for index, cell in enumerate(cells):
+                    if not is_affected(cell, changed):
+                        continue
+                    result = result_of(book, *cell)
+                    if result != results[index]:
+                        results[index] = result
+                        output_func(result)
+                stdout.flush()
+        except KeyboardInterrupt:
+            info('stopped watching [%s]' % database)
@@ -0,0 +1,90 @@
+"""
+Builds small GnuCash books for tests that need a real database.
+"""
+
+import sqlite3
+from datetime import date
+from decimal import Decimal
+from piecash import create_book, open_book, Account, Split, Transaction
+
+# (description, post date, amount spent on food)
+TRANSACTIONS = [
+    ('groceries', date(2016, 1, 5), Decimal('10.00')),
+    ('dinner', date(2016, 1, 20), Decimal('25.50')),
+    ('lunch', date(2016, 1, 31), Decimal('8.25')),
+    ('late dinner', date(2016, 1, 31), Decimal('7.00')),
+    ('refund', date(2016, 2, 10), Decimal('-4.00')),
+    ('leap day', date(2016, 2, 29), Decimal('3.00')),
+    ('breakfast', date(2016, 3, 14), Decimal('6.75')),
+    ('party', date(2016, 4, 30), Decimal('40.00')),
+]
+
+# Post dates stored by older GnuCash versions as local midnight in Europe/Paris, converted to
+# UTC; piecash reads these as the day after their UTC date.
+LOCAL_MIDNIGHT_POST_DATES = {
+    'late dinner': '20160131230000',
+    'leap day': '2016-02-29 23:00:00',
+}
+
+
+def create_test_book(path):
+    """
+    Creates a book at `path` with a Checking and a Food account and the `TRANSACTIONS` between
+    them, with the `LOCAL_MIDNIGHT_POST_DATES` stored as-is.
+    """
+    book = create_book(sqlite_file=path, currency='USD')
+    currency = book.default_currency
+    checking = Account('Checking', 'BANK', currency, parent=book.root_account, code='100')
+    food = Account('Food', 'EXPENSE', currency, parent=book.root_account, code='500')
+    for (description, post_date, amount) in TRANSACTIONS:
+        Transaction(currency, description, post_date=post_date,
+                    splits=[Split(checking, -amount), Split(food, amount)])
+    book.save()
+    book.close()
+
+    for (description, post_date) in LOCAL_MIDNIGHT_POST_DATES.items():
+        set_post_date(path, description, post_date)
+
+
+def add_transaction(path, description, post_date, amount):
+    """
+    Adds a transaction spending `amount` on food to the book at `path`.
+    """
+    book = open_book(path, readonly=False, open_if_lock=True)
+    checking = book.accounts(name='Checking')
+    food = book.accounts(name='Food')
+    Transaction(book.default_currency, description, post_date=post_date,
+                splits=[Split(checking, -amount), Split(food, amount)])
+    book.save()
+    book.close()
+
+
+def set_post_date(path, description, post_date):
+    """
+    Stores the given raw post date on the transaction with the given description.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute('UPDATE transactions SET post_date = ? WHERE description = ?',
+                       (post_date, description))
+    connection.commit()
+    connection.close()
+
+
+def orm_balance(account, begin, end):
+    """
+    Returns the signed total of the account's splits posted between `begin` and `end`, walking
+    `account.splits` as the reports originally did.
+    """
+    return sum((split.value * account.sign for split in account.splits
+                if begin <= split.transaction.post_date <= end), Decimal(0))
+
+
+def orm_split_totals(account, begin, end):
+    """
+    Returns the (positive, negative) totals of the values of the account's splits posted between
+    `begin` and `end`, walking `account.splits` as the reports originally did.
+    """
+    values = [split.value for split in account.splits
+              if begin <= split.transaction.post_date <= end]
+    return (sum((value for value in values if value >= 0), Decimal(0)),
+            sum((value for value in values if value < 0), Decimal(0)))
@@ -0,0 +1,65 @@
+"""
+Unit tests for report functions
+"""
+
+import os
+from datetime import date
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from unittest.mock import patch
+from piecash import open_book
+from pytz import timezone
+from accounting_reports import accounting_reports
+from tests.book import create_test_book, orm_balance, orm_split_totals
+
+
+@patch('piecash.sa_extra.tz', timezone('Europe/Paris'))
+class TestAccountingReports(TestCase):
+    """
+    Tests for `accounting_reports.accounting_reports` balances against a real book, in a timezone
+    where some post dates fall on a different day in UTC.
+    """
+
+    ranges = [
+        (date(2016, 1, 1), date(2016, 1, 31)),
+        (date(2016, 1, 31), date(2016, 1, 31)),
+        (date(2016, 2, 1), date(2016, 2, 29)),
+        (date(2016, 2, 29), date(2016, 3, 1)),
+        (date(2016, 3, 1), date(2016, 4, 30)),
+        (date(2016, 1, 1), date(2016, 12, 31)),
+    ]
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.database = os.path.join(self.directory, 'book.gnucash')
+        create_test_book(self.database)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_balance_of(self):
+        """
+        confirms that balances match a walk of the account's splits
+        """
+        with open_book(self.database, open_if_lock=True) as book:
+            for account in (book.accounts(name='Checking'), book.accounts(name='Food')):
+                for (begin, end) in self.ranges:
+                    self.assertEqual(accounting_reports.balance_of(account, begin, end),
+                                     orm_balance(account, begin, end),
+                                     '%s over %s--%s' % (account.name, begin, end))
+
+    def test_budget_balance_of(self):
+        """
+        confirms that budgeted and actual amounts match a walk of the account's splits
+        """
+        with open_book(self.database, open_if_lock=True) as book:
+            for account in (book.accounts(name='Checking'), book.accounts(name='Food')):
+                for (begin, end) in self.ranges:
+                    self.assertEqual(accounting_reports.budget_balance_of(account, begin, end),
+                                     orm_split_totals(account, begin, end),
+                                     '%s over %s--%s' % (account.name, begin, end))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Unit tests for snapshot functions
+"""
+
+import os
+from datetime import date
+from decimal import Decimal
+from json import load
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from unittest.mock import patch
+from piecash import open_book
+from pytz import timezone
+from accounting_reports import snapshot
+from tests.book import create_test_book, add_transaction, orm_balance, orm_split_totals
+
+
+class TestSnapshot(TestCase):
+    """
+    Tests for misc. `accounting_reports.snapshot` methods
+    """
+
+    rows = [
+        ('acct1', 'split2', date(2018, 1, 20), -525, 100),
+        ('acct1', 'split1', date(2018, 1, 5), 1000, 100),
+        ('acct1', 'split3', date(2018, 3, 1), 5, 2),
+        ('acct2', 'split4', date(2018, 1, 31), 1, 1),
+    ]
+
+    def test_monthly_totals_normal(self):
+        """
+        Normal case
+        """
+        actual = snapshot.monthly_totals(self.rows)
+        self.assertEqual(sorted(actual['acct1']), ['2018-01', '2018-03'])
+        self.assertEqual(actual['acct1']['2018-01']['value'], Decimal('4.75'))
+        self.assertEqual(actual['acct1']['2018-03']['value'], Decimal('2.50'))
+        self.assertEqual(actual['acct2']['2018-01']['value'], Decimal('1.00'))
+
+    def test_monthly_totals_hash_order(self):
+        """
+        case: the month hash doesn't depend on the order splits are read in
+        """
+        expected = snapshot.monthly_totals(self.rows)
+        actual = snapshot.monthly_totals(reversed(self.rows))
+        self.assertEqual(expected['acct1']['2018-01']['hash'], actual['acct1']['2018-01']['hash'])
+
+    def test_monthly_totals_hash_changed(self):
+        """
+        case: changing a split's value or date changes the hash of its month only
+        """
+        expected = snapshot.monthly_totals(self.rows)
+        value = snapshot.monthly_totals([('acct1', 'split2', date(2018, 1, 20), -526, 100)]
+                                        + self.rows[1:])
+        post_date = snapshot.monthly_totals([('acct1', 'split2', date(2018, 1, 21), -525, 100)]
+                                            + self.rows[1:])
+        self.assertNotEqual(expected['acct1']['2018-01']['hash'], value['acct1']['2018-01']['hash'])
+        self.assertNotEqual(expected['acct1']['2018-01']['hash'],
+                            post_date['acct1']['2018-01']['hash'])
+        self.assertEqual(expected['acct1']['2018-03']['hash'], value['acct1']['2018-03']['hash'])
+
+    def test_update_months_extended(self):
+        """
+        case: adding later months extends the cumulative value of earlier ones
+        """
+        accounts = {}
+        names = {'acct1': 'Assets:Checking'}
+        self.assertEqual(snapshot.update_months(accounts, snapshot.monthly_totals(self.rows[:2]),
+                                                names), 1)
+        self.assertEqual(snapshot.update_months(accounts, snapshot.monthly_totals(self.rows[:3]),
+                                                names), 1)
+        months = accounts['acct1']['months']
+        self.assertEqual(accounts['acct1']['account_name'], 'Assets:Checking')
+        self.assertEqual(Decimal(months['2018-01']['cumulative']), Decimal('4.75'))
+        self.assertEqual(Decimal(months['2018-03']['cumulative']), Decimal('7.25'))
+
+    def test_update_months_back_dated(self):
+        """
+        case: a back-dated split rewrites its month and the cumulative values after it
+        """
+        accounts = {}
+        snapshot.update_months(accounts, snapshot.monthly_totals(self.rows), {})
+        rows = self.rows + [('acct1', 'split5', date(2018, 2, 10), -1, 1)]
+        self.assertEqual(snapshot.update_months(accounts, snapshot.monthly_totals(rows), {}), 1)
+        months = accounts['acct1']['months']
+        self.assertEqual(Decimal(months['2018-01']['cumulative']), Decimal('4.75'))
+        self.assertEqual(Decimal(months['2018-02']['cumulative']), Decimal('3.75'))
+        self.assertEqual(Decimal(months['2018-03']['cumulative']), Decimal('6.25'))
+        self.assertEqual(snapshot.update_months(accounts, snapshot.monthly_totals(rows), {}), 0)
+
+    def test_update_months_deleted(self):
+        """
+        case: deleting all of an account's splits removes the account, deleting all of a month's
+        splits removes the month
+        """
+        accounts = {}
+        snapshot.update_months(accounts, snapshot.monthly_totals(self.rows), {})
+        rows = self.rows[2:3]
+        self.assertEqual(snapshot.update_months(accounts, snapshot.monthly_totals(rows), {}), 2)
+        self.assertEqual(sorted(accounts), ['acct1'])
+        self.assertEqual(Decimal(accounts['acct1']['months']['2018-03']['cumulative']),
+                         Decimal('2.50'))
+
+    def test_anchor_of(self):
+        """
+        confirms that the anchor is the latest month end covered by the snapshot
+        """
+        through = date(2018, 12, 31)
+        self.assertEqual(snapshot.anchor_of(date(2018, 6, 15), through), date(2018, 5, 31))
+        self.assertEqual(snapshot.anchor_of(date(2018, 6, 30), through), date(2018, 6, 30))
+        self.assertEqual(snapshot.anchor_of(date(2018, 3, 1), through), date(2018, 2, 28))
+        self.assertEqual(snapshot.anchor_of(date(2019, 2, 10), through), through)
+
+    def test_cumulative_value(self):
+        """
+        confirms that the cumulative value comes from the nearest prior month with activity
+        """
+        accounts = {}
+        snapshot.update_months(accounts, snapshot.monthly_totals(self.rows), {})
+        snap = {'accounts': accounts}
+        self.assertEqual(snapshot.cumulative_value(snap, 'acct1', date(2017, 12, 31)), Decimal(0))
+        self.assertEqual(snapshot.cumulative_value(snap, 'acct1', date(2018, 2, 28)), Decimal('4.75'))
+        self.assertEqual(snapshot.cumulative_value(snap, 'acct1', date(2018, 3, 31)), Decimal('7.25'))
+        self.assertEqual(snapshot.cumulative_value(snap, 'acct3', date(2018, 3, 31)), Decimal(0))
+
+
+@patch('piecash.sa_extra.tz', timezone('Europe/Paris'))
+class TestSnapshotBook(TestCase):
+    """
+    Tests for `accounting_reports.snapshot` against a real book, in a timezone where some post
+    dates fall on a different day in UTC.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.database = os.path.join(self.directory, 'book.gnucash')
+        self.path = os.path.join(self.directory, 'book.gnucash.snapshot.json')
+        create_test_book(self.database)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_month_digests_local_dates(self):
+        """
+        confirms that splits are bucketed by the post date piecash reads, not the UTC one
+        """
+        with open_book(self.database, open_if_lock=True) as book:
+            food = book.accounts(name='Food')
+            months = snapshot.month_digests(book)[food.guid]
+        self.assertEqual(months['2016-01']['value'], Decimal('43.75'))
+        self.assertEqual(months['2016-02']['value'], Decimal('3.00'))
+        self.assertEqual(months['2016-03']['value'], Decimal('9.75'))
+
+    def test_split_totals(self):
+        """
+        confirms that the split totals match a walk of the account's splits, including splits
+        posted at local midnight on the first and last days of the range
+        """
+        dates = [date(2016, 1, 1), date(2016, 1, 31), date(2016, 2, 1), date(2016, 2, 10),
+                 date(2016, 2, 29), date(2016, 3, 1), date(2016, 4, 30)]
+        with open_book(self.database, open_if_lock=True) as book:
+            for account in (book.accounts(name='Checking'), book.accounts(name='Food')):
+                for begin in dates:
+                    for end in dates:
+                        if end < begin:
+                            continue
+                        self.assertEqual(
+                            snapshot.split_totals(book, account.guid, begin, end),
+                            orm_split_totals(account, begin, end),
+                            '%s over %s--%s' % (account.name, begin, end))
+
+    def test_snapshot_balance_of(self):
+        """
+        confirms that balances from the snapshot match a full scan for month-end and mid-month
+        dates on either side of the snapshot
+        """
+        snap = snapshot.build_snapshot(self.database, self.path, date(2016, 2, 29))
+        ends = [date(2016, 1, 15), date(2016, 1, 31), date(2016, 2, 1), date(2016, 2, 29),
+                date(2016, 3, 1), date(2016, 3, 15), date(2016, 4, 30)]
+        with open_book(self.database, open_if_lock=True) as book:
+            for account in (book.accounts(name='Checking'), book.accounts(name='Food')):
+                for begin in (date(2016, 1, 1), date(2016, 2, 1)):
+                    for end in ends:
+                        if end < begin:
+                            continue
+                        self.assertEqual(
+                            snapshot.snapshot_balance_of(book, snap, account, begin, end),
+                            orm_balance(account, begin, end),
+                            '%s over %s--%s' % (account.name, begin, end))
+
+    def test_back_dated(self):
+        """
+        case: a back-dated transaction is reported by verify and repaired by an incremental build
+        """
+        snapshot.build_snapshot(self.database, self.path, date(2016, 3, 31))
+        add_transaction(self.database, 'forgotten', date(2016, 2, 1), Decimal('7.00'))
+
+        results = []
+        self.assertEqual(snapshot.verify_snapshot(self.database, self.path, results.append), 2)
+        self.assertEqual({result['month'] for result in results}, {'2016-02'})
+
+        incremental = snapshot.build_snapshot(self.database, self.path, date(2016, 4, 30))
+        full_path = os.path.join(self.directory, 'full.json')
+        full = snapshot.build_snapshot(self.database, full_path, date(2016, 4, 30), full=True)
+        self.assertEqual(incremental, full)
+        with open(self.path) as incremental_file, open(full_path) as full_file:
+            self.assertEqual(load(incremental_file), load(full_file))
+        self.assertEqual(snapshot.verify_snapshot(self.database, self.path, results.append), 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -106,6 +106,30 @@ class TestUtil(TestCase):
         actual = util.begin_or_default(test_case)
         self.assertEqual(expected, actual)
 
+    def test_previous_month_end(self):
+        """
+        confirms that the previous month end handles YoY overlap and leap years
+        """
+        self.assertEqual(util.previous_month_end(date(2018, 1, 15)), date(2017, 12, 31))
+        self.assertEqual(util.previous_month_end(date(2016, 3, 1)), date(2016, 2, 29))
+        self.assertEqual(util.previous_month_end(date(2018, 7, 31)), date(2018, 6, 30))
+
+    def test_snapshot_or_default(self):
+        """
+        confirms the snapshot path defaults to alongside the database
+        """
+        self.assertEqual(util.snapshot_or_default('book.gnucash', None), 'book.gnucash.snapshot.json')
+        self.assertEqual(util.snapshot_or_default('book.gnucash', 'other.json'), 'other.json')
+
+    def test_bool_arg(self):
+        """
+        confirms option values are read as booleans
+        """
+        self.assertTrue(util.bool_arg('True'))
+        self.assertTrue(util.bool_arg('yes'))
+        self.assertFalse(util.bool_arg('False'))
+        self.assertFalse(util.bool_arg(None))
+
     def test_list_of_months_from_dec(self):
         """
         confirms that the list of months returned:
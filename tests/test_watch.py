@@ -0,0 +1,178 @@
+"""
+Unit tests for watch functions
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from unittest.mock import patch
+from pytz import timezone
+from accounting_reports import watch
+from accounting_reports.snapshot import monthly_totals
+from tests.book import create_test_book, add_transaction, set_post_date, orm_balance
+
+Account = namedtuple('Account', ['guid'])
+Stat = namedtuple('Stat', ['st_mtime_ns', 'st_size'])
+
+
+class TestWatch(TestCase):
+    """
+    Tests for misc. `accounting_reports.watch` methods
+    """
+
+    rows = [
+        ('acct1', 'split1', date(2018, 1, 5), 1000, 100),
+        ('acct1', 'split2', date(2018, 3, 1), 250, 100),
+        ('acct2', 'split3', date(2018, 1, 31), 1, 1),
+    ]
+
+    def test_changed_months_none(self):
+        """
+        case: nothing changed
+        """
+        totals = monthly_totals(self.rows)
+        self.assertEqual(watch.changed_months(totals, monthly_totals(self.rows)), set())
+
+    def test_changed_months_edited(self):
+        """
+        case: an edited split and a new split in a new month and account
+        """
+        previous = monthly_totals(self.rows)
+        rows = list(self.rows)
+        rows[1] = ('acct1', 'split2', date(2018, 3, 1), 275, 100)
+        rows.append(('acct3', 'split4', date(2018, 4, 2), 4, 1))
+        expected = {('acct1', '2018-03'), ('acct3', '2018-04')}
+        self.assertEqual(watch.changed_months(previous, monthly_totals(rows)), expected)
+
+    def test_changed_months_deleted(self):
+        """
+        case: a deleted split
+        """
+        previous = monthly_totals(self.rows)
+        expected = {('acct2', '2018-01')}
+        self.assertEqual(watch.changed_months(previous, monthly_totals(self.rows[:2])), expected)
+
+    def test_is_affected(self):
+        """
+        confirms that a cell is affected only by changes to its account within its date range
+        """
+        changed = {('acct1', '2018-03')}
+        self.assertTrue(watch.is_affected((Account('acct1'), date(2018, 1, 1), date(2018, 3, 31)), changed))
+        self.assertTrue(watch.is_affected((Account('acct1'), date(2018, 3, 15), date(2018, 3, 20)), changed))
+        self.assertFalse(watch.is_affected((Account('acct1'), date(2018, 1, 1), date(2018, 2, 28)), changed))
+        self.assertFalse(watch.is_affected((Account('acct2'), date(2018, 1, 1), date(2018, 3, 31)), changed))
+
+    def test_cells_scope(self):
+        """
+        confirms that the scope covers every cell's account and dates
+        """
+        cells = [
+            (Account('acct1'), date(2018, 1, 1), date(2018, 1, 31)),
+            (Account('acct2'), date(2018, 1, 1), date(2018, 3, 31)),
+        ]
+        expected = (date(2017, 12, 31), date(2018, 3, 31), {'acct1', 'acct2'})
+        self.assertEqual(watch.cells_scope(cells), expected)
+
+    def test_file_changes_missing(self):
+        """
+        case: the file briefly goes missing while being saved
+        """
+        stats = [Stat(1, 10), FileNotFoundError('book.gnucash'), Stat(2, 10)]
+        with patch('accounting_reports.watch.os.stat', side_effect=stats) as stat:
+            next(watch.file_changes('book.gnucash', interval=0))
+        self.assertEqual(stat.call_count, 3)
+
+
+
+@patch('piecash.sa_extra.tz', timezone('Europe/Paris'))
+class TestWatchBook(TestCase):
+    """
+    Tests for `accounting_reports.watch.watch_book` against a real book that's saved once while
+    being watched.
+    """
+
+    month_ends = [date(2016, 1, 31), date(2016, 2, 29), date(2016, 3, 31), date(2016, 4, 30)]
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.database = os.path.join(self.directory, 'book.gnucash')
+        create_test_book(self.database)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def watch(self, save):
+        """
+        Returns the results output while watching the book's cumulative monthly balances, and
+        calling `save` on its path as the one change to the file.
+        """
+        def cells_of(book):
+            return [(account, date(2016, 1, 1), month_end) for month_end in self.month_ends
+                    for account in (book.accounts(name='Checking'), book.accounts(name='Food'))]
+
+        def result_of(book, account, begin, end):
+            return (account.name, end, orm_balance(account, begin, end))
+
+        def file_changes(path, interval):
+            save(path)
+            yield
+
+        results = []
+        with patch('accounting_reports.watch.file_changes', file_changes):
+            watch.watch_book(self.database, cells_of, result_of, results.append, open_if_lock=True)
+        # the first results are those of every cell, before the change
+        return results[len(self.month_ends) * 2:]
+
+    def test_watch_book_added(self):
+        """
+        case: a new transaction only re-emits the cells covering its month
+        """
+        actual = self.watch(lambda path: add_transaction(path, 'snack', date(2016, 3, 20),
+                                                         Decimal('2.00')))
+        expected = [
+            ('Checking', date(2016, 3, 31), Decimal('-58.50')),
+            ('Food', date(2016, 3, 31), Decimal('58.50')),
+            ('Checking', date(2016, 4, 30), Decimal('-98.50')),
+            ('Food', date(2016, 4, 30), Decimal('98.50')),
+        ]
+        self.assertEqual(actual, expected)
+
+    def test_watch_book_edited(self):
+        """
+        case: a split edited in place only re-emits the cells of its account covering its month,
+        which is the month piecash reads its post date in
+        """
+        def save(path):
+            connection = sqlite3.connect(path)
+            connection.execute(
+                'UPDATE splits SET value_num = 1000, quantity_num = 1000 WHERE tx_guid = '
+                '(SELECT guid FROM transactions WHERE description = ?) AND value_num > 0',
+                ('leap day',))
+            connection.commit()
+            connection.close()
+
+        expected = [
+            ('Food', date(2016, 3, 31), Decimal('63.50')),
+            ('Food', date(2016, 4, 30), Decimal('103.50')),
+        ]
+        self.assertEqual(self.watch(save), expected)
+
+    def test_watch_book_re_dated(self):
+        """
+        case: a transaction moved to a later month only re-emits the cells whose balance changed
+        """
+        actual = self.watch(lambda path: set_post_date(path, 'breakfast', '20160415100000'))
+        expected = [
+            ('Checking', date(2016, 3, 31), Decimal('-49.75')),
+            ('Food', date(2016, 3, 31), Decimal('49.75')),
+        ]
+        self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    main()